@@ -8,13 +8,17 @@ https://github.com/charnley/rmsd
 
 __version__ = '1.3.2'
 
-import copy
 import gzip
+import hashlib
+import io
+import itertools
+import os
 import re
+from collections import namedtuple
 
 import numpy as np
+from scipy.linalg.lapack import _compute_lwork, get_lapack_funcs
 from scipy.optimize import linear_sum_assignment
-from scipy.spatial.distance import cdist
 
 AXIS_SWAPS = np.array([
     [0, 1, 2],
@@ -34,6 +38,16 @@ AXIS_REFLECTIONS = np.array([
     [1, -1, -1],
     [-1, -1, -1]])
 
+# Handedness of each axis swap and reflection, a product of -1 gives the
+# enantiomer
+_SWAP_MASK = np.array([1, -1, -1, 1, -1, 1])
+_REFLECTION_MASK = np.array([1, -1, -1, -1, 1, 1, 1, -1])
+
+_EYE3 = np.eye(3)
+
+# Coordinates stored as three contiguous (N) arrays, one per axis
+Coords = namedtuple('Coords', 'x y z')
+
 
 # Dictionary of all elements matched with their atomic masses. Thanks to
 # https://gist.github.com/lukasrichters14/c862644d4cbcf2d67252a484b7c6049c
@@ -68,6 +82,16 @@ ELEMENTS_WEIGHTS = {'h' : 1.008,'he' : 4.003, 'li' : 6.941, 'be' : 9.012,
                  'nh' : 284, 'fl' : 289, 'mc' : 288, 'lv' : 292, 'ts' : 294,
                  'og' : 294}
 
+# Atomic masses as an array, indexed through the element keys above
+_ELEMENTS_KEYS = {k: i for i, k in enumerate(ELEMENTS_WEIGHTS)}
+_ELEMENTS_MASS = np.fromiter(ELEMENTS_WEIGHTS.values(), dtype=float)
+
+
+class ParseError(ValueError):
+    """
+    Raised when a structure file cannot be read.
+    """
+
 
 def rmsd(V, W):
     """
@@ -88,6 +112,233 @@ def rmsd(V, W):
     return np.sqrt((diff * diff).sum() / N)
 
 
+def _prep_coord(X):
+    """
+    Get X as a C-contiguous array, so that the matrix products on it go
+    through BLAS. Single precision input is kept, anything else is converted
+    to double precision.
+    Parameters
+    ----------
+    X : array
+        (N,D) matrix, where N is points and D is dimension.
+    Returns
+    -------
+    X : array
+        (N,D) C-contiguous float32 or float64 matrix
+    """
+    X = np.asarray(X)
+    dtype = np.float32 if X.dtype == np.float32 else np.float64
+    return np.ascontiguousarray(X, dtype=dtype)
+
+
+# LAPACK gesdd handle and workspace size for 3x3 matrices, queried once at
+# import instead of on every np.linalg.svd call
+_SVD_TEMPLATE = np.empty((3, 3))
+_gesdd, _gesdd_lwork = get_lapack_funcs(('gesdd', 'gesdd_lwork'), (_SVD_TEMPLATE,))
+_GESDD_LWORK = _compute_lwork(_gesdd_lwork, 3, 3, compute_uv=1, full_matrices=1)
+
+
+def _svd3x3(C):
+    """
+    Singular value decomposition C = U * diag(S) * Vt of a 3x3 matrix, calling
+    LAPACK gesdd directly with a precomputed workspace size.
+    Parameters
+    ----------
+    C : array
+        (3,3) matrix
+    Returns
+    -------
+    U : array
+        (3,3) matrix of left singular vectors
+    S : array
+        (3) vector of singular values, in descending order
+    Vt : array
+        (3,3) matrix of right singular vectors, transposed
+    """
+    U, S, Vt, info = _gesdd(C, compute_uv=1, full_matrices=1,
+                            lwork=_GESDD_LWORK, overwrite_a=1)
+    if info != 0:
+        raise np.linalg.LinAlgError("SVD did not converge")
+    return U, S, Vt
+
+
+def _qcp_rmsd_from_C(C, G, N):
+    """
+    Minimal RMSD between two centered structures from their covariance
+    matrix, using the quaternion characteristic polynomial (QCP) method.
+    The largest eigenvalue of the 4x4 key matrix is found by Newton
+    iteration on its characteristic polynomial, so no SVD or rotation
+    matrix is needed. This only pays off when compiled with numba, as in the
+    brute force kernel; in Python _svd_rmsd_from_C is faster.
+    See Theobald, Acta Cryst. A61, 478-480 (2005) and
+    Liu et al., J. Comput. Chem. 31, 1561-1563 (2010).
+    Parameters
+    ----------
+    C : array
+        (3,3) covariance matrix P^T Q
+    G : float
+        Sum of the squared norms of all points in P and Q
+    N : int
+        Number of points
+    Returns
+    -------
+    rmsd : float
+        root-mean squared deviation
+    """
+    Sxx = C[0, 0]
+    Sxy = C[0, 1]
+    Sxz = C[0, 2]
+    Syx = C[1, 0]
+    Syy = C[1, 1]
+    Syz = C[1, 2]
+    Szx = C[2, 0]
+    Szy = C[2, 1]
+    Szz = C[2, 2]
+
+    Sxx2 = Sxx * Sxx
+    Syy2 = Syy * Syy
+    Szz2 = Szz * Szz
+    Sxy2 = Sxy * Sxy
+    Syz2 = Syz * Syz
+    Sxz2 = Sxz * Sxz
+    Syx2 = Syx * Syx
+    Szy2 = Szy * Szy
+    Szx2 = Szx * Szx
+
+    SyzSzymSyySzz2 = 2.0 * (Syz * Szy - Syy * Szz)
+    Sxx2Syy2Szz2Syz2Szy2 = Syy2 + Szz2 - Sxx2 + Syz2 + Szy2
+    Sxy2Sxz2Syx2Szx2 = Sxy2 + Sxz2 - Syx2 - Szx2
+
+    SxzpSzx = Sxz + Szx
+    SyzpSzy = Syz + Szy
+    SxypSyx = Sxy + Syx
+    SyzmSzy = Syz - Szy
+    SxzmSzx = Sxz - Szx
+    SxymSyx = Sxy - Syx
+    SxxpSyy = Sxx + Syy
+    SxxmSyy = Sxx - Syy
+
+    # Coefficients of the characteristic polynomial
+    # lambda^4 + c2 lambda^2 + c1 lambda + c0 of the key matrix
+    c2 = -2.0 * (Sxx2 + Syy2 + Szz2 + Sxy2 + Syx2 + Sxz2 + Szx2 + Syz2 + Szy2)
+    c1 = 8.0 * (Sxx * Syz * Szy + Syy * Szx * Sxz + Szz * Sxy * Syx
+                - Sxx * Syy * Szz - Syz * Szx * Sxy - Szy * Syx * Sxz)
+    c0 = (Sxy2Sxz2Syx2Szx2 * Sxy2Sxz2Syx2Szx2
+          + (Sxx2Syy2Szz2Syz2Szy2 + SyzSzymSyySzz2)
+          * (Sxx2Syy2Szz2Syz2Szy2 - SyzSzymSyySzz2)
+          + (-SxzpSzx * SyzmSzy + SxymSyx * (SxxmSyy - Szz))
+          * (-SxzmSzx * SyzpSzy + SxymSyx * (SxxmSyy + Szz))
+          + (-SxzpSzx * SyzpSzy - SxypSyx * (SxxpSyy - Szz))
+          * (-SxzmSzx * SyzmSzy - SxypSyx * (SxxpSyy + Szz))
+          + (SxypSyx * SyzpSzy + SxzpSzx * (SxxmSyy + Szz))
+          * (-SxymSyx * SyzmSzy + SxzpSzx * (SxxpSyy + Szz))
+          + (SxypSyx * SyzmSzy + SxzmSzx * (SxxmSyy - Szz))
+          * (-SxymSyx * SyzpSzy + SxzmSzx * (SxxpSyy - Szz)))
+
+    # Newton iteration from the upper bound G/2 of the largest eigenvalue
+    E0 = G * 0.5
+    eigval = E0
+    for i in range(50):
+        old_eigval = eigval
+        x2 = eigval * eigval
+        b = (x2 + c2) * eigval
+        a = b + c1
+        denom = 2.0 * x2 * eigval + b + a
+        if denom == 0.0:
+            break
+        eigval -= (a * eigval + c0) / denom
+        if abs(eigval - old_eigval) < abs(1e-11 * eigval):
+            break
+
+    msd = 2.0 * (E0 - eigval) / N
+
+    # Near a double root, as for linear structures, the polynomial is too
+    # flat for Newton to find the eigenvalue to more than half precision.
+    # Use the singular values of C instead.
+    x2 = eigval * eigval
+    if abs(4.0 * x2 * eigval + 2.0 * c2 * eigval + c1) < 1e-3 * abs(x2 * eigval):
+        S = np.linalg.svd(C)[1]
+        det = (Sxx * (Syy * Szz - Syz * Szy)
+               - Sxy * (Syx * Szz - Syz * Szx)
+               + Sxz * (Syx * Szy - Syy * Szx))
+        if det < 0.0:
+            msd = (G - 2.0 * (S[0] + S[1] - S[2])) / N
+        else:
+            msd = (G - 2.0 * (S[0] + S[1] + S[2])) / N
+
+    if msd < 0.0:
+        msd = 0.0
+    return np.sqrt(msd)
+
+
+def _svd_rmsd_from_C(C, G, N):
+    """
+    Minimal RMSD between two centered structures from their covariance
+    matrix, using the singular values of the matrix instead of rotating the
+    structures.
+    Parameters
+    ----------
+    C : array
+        (3,3) covariance matrix P^T Q
+    G : float
+        Sum of the squared norms of all points in P and Q
+    N : int
+        Number of points
+    Returns
+    -------
+    rmsd : float
+        root-mean squared deviation
+    """
+    # The smallest singular value is subtracted for a reflection, det(C) < 0
+    (a, b, c), (d, e, f), (g, h, i) = C.tolist()
+    det = a * (e * i - f * h) - b * (d * i - f * g) + c * (d * h - e * g)
+
+    U, S, Vt = _svd3x3(C)
+    if det < 0.0:
+        msd = (G - 2.0 * (S[0] + S[1] - S[2])) / N
+    else:
+        msd = (G - 2.0 * (S[0] + S[1] + S[2])) / N
+
+    if msd < 0.0:
+        msd = 0.0
+    return np.sqrt(msd)
+
+
+def _svd_rmsd(P, Q):
+    """
+    Minimal RMSD between two centered structures P and Q, from the singular
+    values of their covariance matrix and without rotating P.
+    Parameters
+    ----------
+    P : array
+        (N,D) matrix, where N is points and D is dimension.
+    Q : array
+        (N,D) matrix, where N is points and D is dimension.
+    Returns
+    -------
+    rmsd : float
+        root-mean squared deviation
+    """
+    # G - 2 (S0 + S1 + S2) cancels most digits, so always work in double
+    # precision
+    P = np.asarray(P, dtype=np.float64)
+    Q = np.asarray(Q, dtype=np.float64)
+
+    if P.shape[1] != 3:
+        return rmsd(kabsch_rotate(P, Q), Q)
+
+    C = np.dot(P.T, Q)
+    G = (P * P).sum() + (Q * Q).sum()
+    result = _svd_rmsd_from_C(C, G, len(P))
+
+    # For (nearly) identical structures the RMSD is below the precision of
+    # G - 2 (S0 + S1 + S2), so rotate P and take the difference instead
+    if result * result * len(P) < 2e-10 * G:
+        result = rmsd(kabsch_rotate(P, Q), Q)
+
+    return result
+
+
 def kabsch_rmsd(P, Q, W=None, translate=False):
     """
     Rotate matrix P unto Q using Kabsch algorithm and calculate the RMSD.
@@ -115,8 +366,8 @@ def kabsch_rmsd(P, Q, W=None, translate=False):
     if W is not None:
         return kabsch_weighted_rmsd(P, Q, W)
 
-    P = kabsch_rotate(P, Q)
-    return rmsd(P, Q)
+    # Only the RMSD is needed, so skip the rotation of P
+    return _svd_rmsd(P, Q)
 
 
 def kabsch_rotate(P, Q):
@@ -184,7 +435,7 @@ def kabsch_fit(P, Q, W=None):
     # right-handed coordinate system.
     # And finally calculating the optimal rotation matrix U
     # see http://en.wikipedia.org/wiki/Kabsch_algorithm
-    V, S, W = np.linalg.svd(C)
+    V, S, W = _svd3x3(C)
     d = (np.linalg.det(V) * np.linalg.det(W)) < 0.0
 
     if d:
@@ -225,9 +476,12 @@ def kabsch(P, Q):
     U : matrix
         Rotation matrix (D,D)
     """
+    P = _prep_coord(P)
+    Q = _prep_coord(Q)
 
-    # Computation of the covariance matrix
-    C = np.dot(np.transpose(P), Q)
+    # Computation of the covariance matrix, always decomposed in double
+    # precision
+    C = np.dot(np.transpose(P), Q).astype(np.float64, copy=False)
 
     # Computation of the optimal rotation matrix
     # This can be done using singular value decomposition (SVD)
@@ -236,7 +490,7 @@ def kabsch(P, Q):
     # right-handed coordinate system.
     # And finally calculating the optimal rotation matrix U
     # see http://en.wikipedia.org/wiki/Kabsch_algorithm
-    V, S, W = np.linalg.svd(C)
+    V, S, W = _svd3x3(C)
     d = (np.linalg.det(V) * np.linalg.det(W)) < 0.0
 
     if d:
@@ -278,25 +532,23 @@ def kabsch_weighted(P, Q, W=None):
     RMSD : float
            Root mean squared deviation between P and Q
     """
+    P = _prep_coord(P)
+    Q = _prep_coord(Q)
+
     # Computation of the weighted covariance matrix
-    CMP = np.zeros(3)
-    CMQ = np.zeros(3)
-    C = np.zeros((3, 3))
     if W is None:
-        W  = np.ones(len(P)) / len(P)
-    W = np.array([W, W, W]).T
+        W = np.full(len(P), 1.0 / len(P))
+    W = np.asarray(W, dtype=float)
     # NOTE UNUSED psq = 0.0
     # NOTE UNUSED qsq = 0.0
-    iw = 3.0 / W.sum()
-    n = len(P)
-    for i in range(3):
-        for j in range(n):
-            for k in range(3):
-                C[i, k] += P[j, i] * Q[j, k] * W[j, i]
-    CMP = (P * W).sum(axis=0)
-    CMQ = (Q * W).sum(axis=0)
-    PSQ = (P * P * W).sum() - (CMP * CMP).sum() * iw
-    QSQ = (Q * Q * W).sum() - (CMQ * CMQ).sum() * iw
+    iw = 1.0 / W.sum()
+    PW = P * W[:, None]
+    QW = Q * W[:, None]
+    C = np.dot(PW.T, Q)
+    CMP = PW.sum(axis=0)
+    CMQ = QW.sum(axis=0)
+    PSQ = (P * PW).sum() - (CMP * CMP).sum() * iw
+    QSQ = (Q * QW).sum() - (CMQ * CMQ).sum() * iw
     C = (C - np.outer(CMP, CMQ) * iw)  * iw
 
     # Computation of the optimal rotation matrix
@@ -306,7 +558,7 @@ def kabsch_weighted(P, Q, W=None):
     # right-handed coordinate system.
     # And finally calculating the optimal rotation matrix U
     # see http://en.wikipedia.org/wiki/Kabsch_algorithm
-    V, S, W = np.linalg.svd(C)
+    V, S, W = _svd3x3(C)
     d = (np.linalg.det(V) * np.linalg.det(W)) < 0.0
 
     if d:
@@ -319,11 +571,7 @@ def kabsch_weighted(P, Q, W=None):
     if msd < 0.0:
         msd = 0.0
     rmsd = np.sqrt(msd)
-    V = np.zeros(3)
-    for i in range(3):
-        t = (U[i, :] * CMQ).sum()
-        V[i] = CMP[i] - t
-    V = V * iw
+    V = (CMP - np.dot(U, CMQ)) * iw
     return U, V, rmsd
 
 
@@ -430,6 +678,28 @@ def makeQ(r1, r2, r3, r4=0):
     return Q
 
 
+# Element indices and signs of the matrices built by makeW and makeQ, such
+# that makeW(*r)[i, j] == _W_SIGN[i, j] * r[_QUATERNION_IDX[i, j]], and the
+# same for makeQ with _Q_SIGN
+_QUATERNION_IDX = np.array([
+    [3, 2, 1, 0],
+    [2, 3, 0, 1],
+    [1, 0, 3, 2],
+    [0, 1, 2, 3]])
+
+_W_SIGN = np.array([
+    [1, 1, -1, 1],
+    [-1, 1, 1, 1],
+    [1, -1, 1, 1],
+    [-1, -1, -1, 1]])
+
+_Q_SIGN = np.array([
+    [1, -1, 1, 1],
+    [1, 1, -1, 1],
+    [-1, 1, 1, 1],
+    [-1, -1, -1, 1]])
+
+
 def quaternion_rotate(X, Y):
     """
     Calculate the rotation
@@ -444,14 +714,22 @@ def quaternion_rotate(X, Y):
     rot : matrix
         Rotation matrix (D,D)
     """
+    X = _prep_coord(X)
+    Y = _prep_coord(Y)
     N = X.shape[0]
-    W = np.asarray([makeW(*Y[k]) for k in range(N)])
-    Q = np.asarray([makeQ(*X[k]) for k in range(N)])
-    Qt_dot_W = np.asarray([np.dot(Q[k].T, W[k]) for k in range(N)])
-    # NOTE UNUSED W_minus_Q = np.asarray([W[k] - Q[k] for k in range(N)])
-    A = np.sum(Qt_dot_W, axis=0)
-    eigen = np.linalg.eigh(A)
-    r = eigen[1][:, eigen[0].argmax()]
+
+    # Build all makeW(*Y[k]) and makeQ(*X[k]) matrices at once, with r4 = 0
+    X4 = np.hstack((X, np.zeros((N, 1), dtype=X.dtype)))
+    Y4 = np.hstack((Y, np.zeros((N, 1), dtype=Y.dtype)))
+    W = _W_SIGN * Y4[:, _QUATERNION_IDX]
+    Q = _Q_SIGN * X4[:, _QUATERNION_IDX]
+
+    # A = sum_k Q[k]^T W[k]
+    A = np.einsum('kji,kjl->il', Q, W)
+
+    # eigh returns the eigenvalues in ascending order
+    eigval, eigvec = np.linalg.eigh(A)
+    r = eigvec[:, -1]
     rot = quaternion_transform(r)
     return rot
 
@@ -475,7 +753,51 @@ def centroid(X):
     return C
 
 
-def reorder_distance(p_atoms, q_atoms, p_coord, q_coord):
+def _atom_type_blocks(atoms):
+    """
+    Group the atom indices by atom type, with a single sort.
+    Parameters
+    ----------
+    atoms : array
+        (N,1) matrix, where N is points holding the atoms' names
+    Returns
+    -------
+    unique_atoms : array
+        Sorted unique atom types
+    blocks : list
+        Array of the (ascending) indices of each atom type
+    """
+    unique_atoms, inverse = np.unique(atoms, return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    offsets = np.concatenate(([0], np.bincount(inverse).cumsum()))
+    blocks = [order[offsets[i]:offsets[i + 1]] for i in range(len(unique_atoms))]
+    return unique_atoms, blocks
+
+
+def _paired_atom_type_blocks(p_atoms, q_atoms):
+    """
+    Get the indices of each atom type of P, paired with the indices of the
+    same atom type in Q.
+    Parameters
+    ----------
+    p_atoms : array
+        (N,1) matrix, where N is points holding the atoms' names
+    q_atoms : array
+        (N,1) matrix, where N is points holding the atoms' names
+    Returns
+    -------
+    blocks : list
+        (p_atom_idx, q_atom_idx) pairs, one per atom type of P
+    """
+    p_types, p_blocks = _atom_type_blocks(p_atoms)
+    q_types, q_blocks = _atom_type_blocks(q_atoms)
+    q_lookup = dict(zip(q_types, q_blocks))
+    empty = np.zeros(0, dtype=np.intp)
+    return [(p_idx, q_lookup.get(atom, empty))
+            for atom, p_idx in zip(p_types, p_blocks)]
+
+
+def reorder_distance(p_atoms, q_atoms, p_coord, q_coord, _blocks=None):
     """
     Re-orders the input atom list and xyz coordinates by atom type and then by
     distance of each atom from the centroid.
@@ -493,23 +815,22 @@ def reorder_distance(p_atoms, q_atoms, p_coord, q_coord):
         (N,D) matrix, where N is points and D is dimension (rows re-ordered)
     """
 
-    # Find unique atoms
-    unique_atoms = np.unique(p_atoms)
+    # Find the indices of each atom type
+    if _blocks is None:
+        _blocks = _paired_atom_type_blocks(p_atoms, q_atoms)
 
     # generate full view from q shape to fill in atom view on the fly
     view_reorder = np.zeros(q_atoms.shape, dtype=int)
 
-    for atom in unique_atoms:
+    # Calculate the squared distance from each atom to centroid. The square
+    # root is skipped as it does not change the ordering.
+    p_norms = np.einsum('ij,ij->i', p_coord, p_coord)
+    q_norms = np.einsum('ij,ij->i', q_coord, q_coord)
 
-        p_atom_idx, = np.where(p_atoms == atom)
-        q_atom_idx, = np.where(q_atoms == atom)
+    for p_atom_idx, q_atom_idx in _blocks:
 
-        A_coord = p_coord[p_atom_idx]
-        B_coord = q_coord[q_atom_idx]
-
-        # Calculate distance from each atom to centroid
-        A_norms = np.linalg.norm(A_coord, axis=1)
-        B_norms = np.linalg.norm(B_coord, axis=1)
+        A_norms = p_norms[p_atom_idx]
+        B_norms = q_norms[q_atom_idx]
 
         reorder_indices_A = np.argsort(A_norms)
         reorder_indices_B = np.argsort(B_norms)
@@ -529,7 +850,13 @@ def hungarian(A, B):
     """
 
     # should be kabasch here i think
-    distances = cdist(A, B, 'euclidean')
+    # Euclidean distance matrix from |a - b|^2 = |a|^2 + |b|^2 - 2 a.b, where
+    # the cross term is a single matrix product
+    AA = np.einsum('ij,ij->i', A, A)[:, np.newaxis]
+    BB = np.einsum('ij,ij->i', B, B)[np.newaxis, :]
+    distances = AA + BB - 2.0 * np.dot(A, B.T)
+    np.maximum(distances, 0.0, out=distances)
+    np.sqrt(distances, out=distances)
 
     # Perform Hungarian analysis on distance matrix between atoms of 1st
     # structure and trial structure
@@ -538,7 +865,7 @@ def hungarian(A, B):
     return indices_b
 
 
-def reorder_hungarian(p_atoms, q_atoms, p_coord, q_coord):
+def reorder_hungarian(p_atoms, q_atoms, p_coord, q_coord, _blocks=None):
     """
     Re-orders the input atom list and xyz coordinates using the Hungarian
     method (using optimized column results)
@@ -559,17 +886,15 @@ def reorder_hungarian(p_atoms, q_atoms, p_coord, q_coord):
              coordinates of the atoms
     """
 
-    # Find unique atoms
-    unique_atoms = np.unique(p_atoms)
+    # Find the indices of each atom type
+    if _blocks is None:
+        _blocks = _paired_atom_type_blocks(p_atoms, q_atoms)
 
     # generate full view from q shape to fill in atom view on the fly
     view_reorder = np.zeros(q_atoms.shape, dtype=int)
     view_reorder -= 1
 
-    for atom in unique_atoms:
-        p_atom_idx, = np.where(p_atoms == atom)
-        q_atom_idx, = np.where(q_atoms == atom)
-
+    for p_atom_idx, q_atom_idx in _blocks:
         A_coord = p_coord[p_atom_idx]
         B_coord = q_coord[q_atom_idx]
 
@@ -579,7 +904,7 @@ def reorder_hungarian(p_atoms, q_atoms, p_coord, q_coord):
     return view_reorder
 
 
-def reorder_inertia_hungarian(p_atoms, q_atoms, p_coord, q_coord):
+def reorder_inertia_hungarian(p_atoms, q_atoms, p_coord, q_coord, _blocks=None):
     """
     Align the principal intertia axis and then re-orders the input atom 
     list and xyz coordinates using the Hungarian method 
@@ -600,9 +925,11 @@ def reorder_inertia_hungarian(p_atoms, q_atoms, p_coord, q_coord):
              (N,1) matrix, reordered indexes of atom alignment based on the
              coordinates of the atoms
     """
-    # get the principal axis of P and Q
-    p_axis = get_principal_axis(p_atoms, p_coord)
-    q_axis = get_principal_axis(q_atoms, q_coord)
+    # get the atomic masses and principal axis of P and Q
+    p_masses = _atom_mass(p_atoms)
+    q_masses = _atom_mass(q_atoms)
+    p_axis = get_principal_axis(p_atoms, p_coord, masses=p_masses)
+    q_axis = get_principal_axis(q_atoms, q_coord, masses=q_masses)
 
     # rotate Q onto P considering that the axis are parallel and antiparallel
     U1 = rotation_matrix_vectors(p_axis, q_axis)
@@ -610,8 +937,11 @@ def reorder_inertia_hungarian(p_atoms, q_atoms, p_coord, q_coord):
     q_coord1 = np.dot(q_coord, U1)
     q_coord2 = np.dot(q_coord, U2)
 
-    q_review1 = reorder_hungarian(p_atoms, q_atoms, p_coord, q_coord1)
-    q_review2 = reorder_hungarian(p_atoms, q_atoms, p_coord, q_coord2)
+    if _blocks is None:
+        _blocks = _paired_atom_type_blocks(p_atoms, q_atoms)
+
+    q_review1 = reorder_hungarian(p_atoms, q_atoms, p_coord, q_coord1, _blocks=_blocks)
+    q_review2 = reorder_hungarian(p_atoms, q_atoms, p_coord, q_coord2, _blocks=_blocks)
     q_coord1 = q_coord1[q_review1]
     q_coord2 = q_coord2[q_review2]
 
@@ -646,6 +976,100 @@ def generate_permutations(elements, n):
             i += 1
 
 
+def _brute_permutation_kernel(A, B):
+    """
+    Compiled version of brute_permutation, running Heap's algorithm and the
+    QCP RMSD of every permutation in a single loop.
+    Parameters
+    ----------
+    A : array
+        (N,3) matrix, where N is points
+    B : array
+        (N,3) matrix, where N is points
+    Returns
+    -------
+    view : array
+        (N) vector, reordered view of B projected to A
+    """
+    n = A.shape[0]
+    G = (A * A).sum() + (B * B).sum()
+
+    order = np.arange(n)
+    view_min = order.copy()
+    rmsd_min = np.inf
+
+    c = np.zeros(n, dtype=np.intp)
+    C = np.zeros((3, 3))
+    i = 0
+    while True:
+
+        # Covariance matrix of A and the current permutation of B
+        for j in range(3):
+            for k in range(3):
+                cov = 0.0
+                for a in range(n):
+                    cov += A[a, j] * B[order[a], k]
+                C[j, k] = cov
+
+        rmsd_temp = _qcp_rmsd_from_C_numba(C, G, n)
+        if rmsd_temp < rmsd_min:
+            rmsd_min = rmsd_temp
+            view_min[:] = order
+
+        # Advance to the next permutation
+        while i < n and c[i] >= i:
+            c[i] = 0
+            i += 1
+        if i == n:
+            break
+        if i % 2 == 0:
+            order[0], order[i] = order[i], order[0]
+        else:
+            order[c[i]], order[i] = order[i], order[c[i]]
+        c[i] += 1
+        i = 0
+
+    return view_min
+
+
+# Compiled kernels, set by _load_numba on first use
+_numba_loaded = False
+_qcp_rmsd_from_C_numba = None
+_brute_permutation_numba = None
+
+
+# Number of atoms from which the n! permutations of the compiled brute force
+# repay loading numba
+_NUMBA_BRUTE_MIN_ATOMS = 8
+
+
+def _load_numba():
+    """
+    Compile the numba kernels. numba is imported on first use instead of at
+    module load, because importing it and loading the compiled kernels takes
+    longer than a typical small comparison. Only loops that repay that cost
+    should call this.
+    Returns
+    -------
+    loaded : bool
+        False if numba is not installed
+    """
+    global _numba_loaded
+    global _qcp_rmsd_from_C_numba, _brute_permutation_numba
+
+    if not _numba_loaded:
+        _numba_loaded = True
+        try:
+            from numba import njit
+        except ImportError:
+            return False
+
+        _qcp_rmsd_from_C_numba = njit(cache=True)(_qcp_rmsd_from_C)
+        _brute_permutation_numba = njit(cache=True)(_brute_permutation_kernel)
+
+    return _brute_permutation_numba is not None
+
+
 def brute_permutation(A, B):
     """
     Re-orders the input atom list and xyz coordinates using the brute force
@@ -662,6 +1086,13 @@ def brute_permutation(A, B):
         (N,1) matrix, reordered view of B projected to A
     """
 
+    # The compiled kernel does not check its indices
+    if A.shape != B.shape:
+        raise ValueError("A and B must have the same shape, got {} and {}".format(A.shape, B.shape))
+
+    if len(A) >= _NUMBA_BRUTE_MIN_ATOMS and _load_numba():
+        return _brute_permutation_numba(A, B).tolist()
+
     rmsd_min = np.inf
     view_min = None
 
@@ -671,25 +1102,28 @@ def brute_permutation(A, B):
     num_atoms = A.shape[0]
     initial_order = list(range(num_atoms))
 
-    for reorder_indices in generate_permutations(initial_order, num_atoms):
+    # The Gram trace does not change when the rows of B are permuted, so only
+    # the covariance matrix has to be recomputed for each permutation
+    G = (A * A).sum() + (B * B).sum()
+    AT = A.T.copy()
 
-        # Re-order the atom array and coordinate matrix
-        coords_ordered = B[reorder_indices]
+    for reorder_indices in generate_permutations(initial_order, num_atoms):
 
-        # Calculate the RMSD between structure 1 and the Hungarian re-ordered
+        # Calculate the RMSD between structure 1 and the re-ordered
         # structure 2
-        rmsd_temp = kabsch_rmsd(A, coords_ordered)
+        C = np.dot(AT, B[reorder_indices])
+        rmsd_temp = _svd_rmsd_from_C(C, G, num_atoms)
 
         # Replaces the atoms and coordinates with the current structure if the
         # RMSD is lower
         if rmsd_temp < rmsd_min:
             rmsd_min = rmsd_temp
-            view_min = copy.deepcopy(reorder_indices)
+            view_min = list(reorder_indices)
 
     return view_min
 
 
-def reorder_brute(p_atoms, q_atoms, p_coord, q_coord):
+def reorder_brute(p_atoms, q_atoms, p_coord, q_coord, _blocks=None):
     """
     Re-orders the input atom list and xyz coordinates using all permutation of
     rows (using optimized column results)
@@ -710,17 +1144,15 @@ def reorder_brute(p_atoms, q_atoms, p_coord, q_coord):
         coordinates of the atoms
     """
 
-    # Find unique atoms
-    unique_atoms = np.unique(p_atoms)
+    # Find the indices of each atom type
+    if _blocks is None:
+        _blocks = _paired_atom_type_blocks(p_atoms, q_atoms)
 
     # generate full view from q shape to fill in atom view on the fly
     view_reorder = np.zeros(q_atoms.shape, dtype=int)
     view_reorder -= 1
 
-    for atom in unique_atoms:
-        p_atom_idx, = np.where(p_atoms == atom)
-        q_atom_idx, = np.where(q_atoms == atom)
-
+    for p_atom_idx, q_atom_idx in _blocks:
         A_coord = p_coord[p_atom_idx]
         B_coord = q_coord[q_atom_idx]
 
@@ -737,6 +1169,7 @@ def check_reflections(p_atoms, q_atoms, p_coord, q_coord,
     """
     Minimize RMSD using reflection planes for molecule P and Q
     Warning: This will affect stereo-chemistry
+    P and Q are translated onto their centroids before any comparison.
     Parameters
     ----------
     p_atoms : array
@@ -753,6 +1186,10 @@ def check_reflections(p_atoms, q_atoms, p_coord, q_coord,
     min_swap
     min_reflection
     min_review
+    Raises
+    ------
+    RuntimeError
+        If the atoms of P and the reordered Q do not match
     """
 
     min_rmsd = np.inf
@@ -760,30 +1197,41 @@ def check_reflections(p_atoms, q_atoms, p_coord, q_coord,
     min_reflection = None
     min_review = None
     tmp_review = None
-    swap_mask = [1,-1,-1,1,-1,1]
-    reflection_mask = [1,-1,-1,-1,1,1,1,-1]
-
-    for swap, i in zip(AXIS_SWAPS, swap_mask):
-        for reflection, j in zip(AXIS_REFLECTIONS, reflection_mask):
+    # Center P and Q once. Swapping and reflecting axes are linear maps, so
+    # every variant of a centered Q is still centered.
+    p_centered = p_coord - centroid(p_coord)
+    q_centered = q_coord - centroid(q_coord)
+
+    # Q is reordered from the same atoms for every variant, so the atom type
+    # indices of the built-in reorder methods only have to be found once
+    reorder_kwargs = {}
+    if reorder_method in (reorder_distance, reorder_hungarian,
+                          reorder_inertia_hungarian, reorder_brute):
+        reorder_kwargs['_blocks'] = _paired_atom_type_blocks(p_atoms, q_atoms)
+
+    # All swapped and reflected variants of Q at once, with shape
+    # (reflections, swaps, N, D)
+    q_variants = (q_centered[:, AXIS_SWAPS].transpose(1, 0, 2)
+                  * AXIS_REFLECTIONS[:, np.newaxis, np.newaxis, :])
+
+    for i_swap, (swap, i) in enumerate(zip(AXIS_SWAPS, _SWAP_MASK)):
+        for i_reflection, (reflection, j) in enumerate(zip(AXIS_REFLECTIONS, _REFLECTION_MASK)):
             if keep_stereo and i * j == -1: continue # skip enantiomers
 
-            tmp_atoms = copy.copy(q_atoms)
-            tmp_coord = copy.deepcopy(q_coord)
-            tmp_coord = tmp_coord[:, swap]
-            tmp_coord = np.dot(tmp_coord, np.diag(reflection))
-            tmp_coord -= centroid(tmp_coord)
+            tmp_coord = q_variants[i_reflection, i_swap]
 
-            # Reorder
+            # Reorder. q_atoms is never modified, so it is used as is and
+            # only reordered once for the final check below.
             if reorder_method is not None:
-                tmp_review = reorder_method(p_atoms, tmp_atoms, p_coord, tmp_coord)
+                tmp_review = reorder_method(p_atoms, q_atoms, p_centered,
+                                            tmp_coord, **reorder_kwargs)
                 tmp_coord = tmp_coord[tmp_review]
-                tmp_atoms = tmp_atoms[tmp_review]
 
             # Rotation
             if rotation_method is None:
-                this_rmsd = rmsd(p_coord, tmp_coord)
+                this_rmsd = rmsd(p_centered, tmp_coord)
             else:
-                this_rmsd = rotation_method(p_coord, tmp_coord)
+                this_rmsd = rotation_method(p_centered, tmp_coord)
 
             if this_rmsd < min_rmsd:
                 min_rmsd = this_rmsd
@@ -791,13 +1239,93 @@ def check_reflections(p_atoms, q_atoms, p_coord, q_coord,
                 min_reflection = reflection
                 min_review = tmp_review
 
-    if not (p_atoms == q_atoms[min_review]).all():
-        print("error: Not aligned")
-        quit()
+    if min_review is not None:
+        q_atoms = q_atoms[min_review]
+
+    if not np.array_equal(p_atoms, q_atoms):
+        raise RuntimeError("Not aligned")
 
     return min_rmsd, min_swap, min_reflection, min_review
 
 
+def check_reflections_batch(p_coord, q_coord, backend='cupy',
+                            keep_stereo=False):
+    """
+    Minimize the Kabsch RMSD using reflection planes for molecule P and Q,
+    scoring all swap and reflection variants of Q as one batch. Unlike
+    check_reflections no reordering is done, so the atoms of P and Q must
+    already be in the same order.
+    With the cupy backend the batched covariance matrices, SVDs and RMSDs
+    are computed on the GPU and only the minimum is copied back. For a
+    single small molecule the CPU is usually faster, the GPU pays off when
+    the batch is large.
+    Warning: This will affect stereo-chemistry
+    Parameters
+    ----------
+    p_coord : array
+        (N,3) matrix, where N is points
+    q_coord : array
+        (N,3) matrix, where N is points
+    backend : string (optional)
+        Array module to use, either cupy or numpy
+    keep_stereo : bool (optional)
+        Skip the variants that give the enantiomer
+    Returns
+    -------
+    min_rmsd
+    min_swap
+    min_reflection
+    """
+    if backend == 'cupy':
+        # Imported here, as importing cupy slows down every other use of
+        # the module
+        try:
+            import cupy
+        except ImportError:
+            raise ImportError("check_reflections_batch: cupy is not installed")
+        xp = cupy
+    elif backend == 'numpy':
+        xp = np
+    else:
+        raise ValueError("check_reflections_batch: unknown backend {}".format(backend))
+
+    P = xp.asarray(p_coord, dtype=xp.float64)
+    Q = xp.asarray(q_coord, dtype=xp.float64)
+    P = P - P.mean(axis=0)
+    Q = Q - Q.mean(axis=0)
+    N = P.shape[0]
+
+    # All variants of Q, in the same order as check_reflections, with shape
+    # (swaps * reflections, N, 3)
+    swaps = xp.asarray(AXIS_SWAPS)
+    reflections = xp.asarray(AXIS_REFLECTIONS)
+    variants = (Q[:, swaps].transpose(1, 0, 2)[:, np.newaxis]
+                * reflections[np.newaxis, :, np.newaxis, :])
+    variants = variants.reshape(-1, N, 3)
+
+    # Batched Kabsch, the RMSD follows from the singular values of the
+    # covariance matrices corrected for improper rotations
+    C = xp.einsum('ni,bnj->bij', P, variants)
+    U, S, Vt = xp.linalg.svd(C)
+    d = xp.sign(xp.linalg.det(U) * xp.linalg.det(Vt))
+    S[:, -1] *= d
+
+    # Axis swaps and reflections do not change the norms of Q
+    G = (P * P).sum() + (Q * Q).sum()
+    msd = (G - 2.0 * S.sum(axis=1)) / N
+    rmsds = xp.sqrt(xp.maximum(msd, 0.0))
+
+    if keep_stereo:
+        stereo = xp.asarray(np.outer(_SWAP_MASK, _REFLECTION_MASK).ravel())
+        rmsds[stereo == -1] = xp.inf
+
+    i_min = int(xp.argmin(rmsds))
+    i_swap, i_reflection = divmod(i_min, len(AXIS_REFLECTIONS))
+
+    return (float(rmsds[i_min]), AXIS_SWAPS[i_swap],
+            AXIS_REFLECTIONS[i_reflection])
+
+
 def rotation_matrix_vectors(v1, v2):
     """
     Returns the rotation matrix that rotates v1 onto v2
@@ -805,9 +1333,9 @@ def rotation_matrix_vectors(v1, v2):
     (see https://math.stackexchange.com/a/476311)
     ----------
     v1 : array
-        Dim 3 float array
+        Dim 3 float array, normalized
     v2 : array
-        Dim 3 float array
+        Dim 3 float array, normalized
     Return
     ------
     output : 3x3 matrix
@@ -821,12 +1349,32 @@ def rotation_matrix_vectors(v1, v2):
         return np.array([[-1.,0.,0.],[0.,1.,0.],[0.,0.,-1.]])
     else:
         v = np.cross(v1, v2)
-        s = np.linalg.norm(v)
         c = np.vdot(v1, v2)
 
         vx = np.array([[0., -v[2], v[1]], [v[2], 0., -v[0]], [-v[1], v[0], 0.]])
 
-        return np.eye(3) + vx + np.dot(vx,vx)*((1.-c)/(s*s))
+        # For the cross-product matrix vx^2 = v v^T - (v.v) I, with
+        # s^2 = v.v
+        vv = np.dot(v, v)
+        vx2 = np.outer(v, v) - vv * _EYE3
+
+        return _EYE3 + vx + vx2 * ((1. - c) / vv)
+
+
+def _atom_mass(atoms):
+    """
+    Get the atomic masses of a list of atomic types.
+    ----------
+    atoms : list
+        List of atomic types
+    Return
+    ------
+    output : (N) array
+        The atomic masses
+    """
+    idx = np.fromiter((_ELEMENTS_KEYS[x.lower()] for x in atoms),
+                      dtype=np.intp, count=len(atoms))
+    return _ELEMENTS_MASS[idx]
 
 
 def get_cm(atoms, V):
@@ -842,10 +1390,10 @@ def get_cm(atoms, V):
     output : (3) array
         The CM vector
     """
-    return np.average(V, axis=0, weights=[ELEMENTS_WEIGHTS[x.lower()] for x in atoms])
+    return np.average(V, axis=0, weights=_atom_mass(atoms))
 
 
-def get_inertia_tensor(atoms, V):
+def get_inertia_tensor(atoms, V, masses=None):
     """
     Get the tensor of intertia of V.
     ----------
@@ -853,33 +1401,55 @@ def get_inertia_tensor(atoms, V):
         List of atomic types
     V : array
         (N,3) matrix of atomic coordinates
+    masses : array (optional)
+        (N) vector of atomic masses, looked up from atoms if not given
     Return
     ------
     output : 3x3 float matrix
         The tensor of inertia
     """
-    CV = V - get_cm(atoms, V)
+    m = _atom_mass(atoms) if masses is None else masses
+
+    # Split V into contiguous per-axis arrays with a single copy
+    x, y, z = np.ascontiguousarray(np.transpose(V))
 
-    Ixx = 0.
-    Iyy = 0.
-    Izz = 0.
-    Ixy = 0.
-    Ixz = 0.
-    Iyz = 0.
+    return get_inertia_tensor_soa(m, x, y, z)
 
-    for sp, acoord in zip(atoms, CV):
-        amass = ELEMENTS_WEIGHTS[sp.lower()]
-        Ixx += amass * (acoord[1]*acoord[1] + acoord[2]*acoord[2])
-        Iyy += amass * (acoord[0]*acoord[0] + acoord[2]*acoord[2])
-        Izz += amass * (acoord[0]*acoord[0] + acoord[1]*acoord[1])
-        Ixy += -amass * acoord[0] * acoord[1]
-        Ixz += -amass * acoord[0] * acoord[2]
-        Iyz += -amass * acoord[1] * acoord[2]
+
+def get_inertia_tensor_soa(masses, x, y, z):
+    """
+    Get the tensor of intertia from per-axis coordinate arrays.
+    ----------
+    masses : array
+        (N) vector of atomic masses
+    x, y, z : array
+        (N) vectors of atomic coordinates along each axis
+    Return
+    ------
+    output : 3x3 float matrix
+        The tensor of inertia
+    """
+    m = masses
+    M = m.sum()
+    x = x - (m * x).sum() / M
+    y = y - (m * y).sum() / M
+    z = z - (m * z).sum() / M
+
+    mx2 = (m * x * x).sum()
+    my2 = (m * y * y).sum()
+    mz2 = (m * z * z).sum()
+
+    Ixx = my2 + mz2
+    Iyy = mx2 + mz2
+    Izz = mx2 + my2
+    Ixy = -(m * x * y).sum()
+    Ixz = -(m * x * z).sum()
+    Iyz = -(m * y * z).sum()
 
     return np.array([[Ixx, Ixy, Ixz], [Ixy, Iyy, Iyz], [Ixz, Iyz, Izz]])
 
 
-def get_principal_axis(atoms, V):
+def get_principal_axis(atoms, V, masses=None):
     """
     Get the molecule's principal axis.
     ----------
@@ -887,16 +1457,20 @@ def get_principal_axis(atoms, V):
         List of atomic types
     V : array
         (N,3) matrix of atomic coordinates
+    masses : array (optional)
+        (N) vector of atomic masses, looked up from atoms if not given
     Return
     ------
     output : array
         Array of dim 3 containing the principal axis
     """
-    I = get_inertia_tensor(atoms, V)
+    I = get_inertia_tensor(atoms, V, masses=masses)
 
-    eigval, eigvec = np.linalg.eig(I)
+    # The inertia tensor is symmetric, so use eigh. Eigenvalues are returned
+    # in ascending order and the eigenvectors are the columns of eigvec.
+    eigval, eigvec = np.linalg.eigh(I)
 
-    return eigvec[np.argmax(eigval)]
+    return eigvec[:, -1]
 
 
 def set_coordinates(atoms, V, title="", decimals=8):
@@ -951,7 +1525,37 @@ def print_coordinates(atoms, V, title=""):
     return
 
 
-def get_coordinates(filename, fmt):
+# Directory for the parsed coordinates cache of get_coordinates
+COORDINATES_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "calculate_rmsd")
+
+
+def _coordinates_cache_file(filename, fmt, ignore_hydrogen=False):
+    """
+    Get the cache file of the parsed coordinates of filename. The key
+    includes the modification time and size of the file, so a changed file
+    is parsed again.
+    Parameters
+    ----------
+    filename : string
+        Filename to read
+    fmt : string
+        Format of filename
+    ignore_hydrogen : bool (optional)
+        If the hydrogen atoms are left out
+    Returns
+    -------
+    cache_file : string
+        Path of the .npz cache file
+    """
+    stat = os.stat(filename)
+    key = "{}:{}:{}:{}:{}:{}".format(os.path.abspath(filename), fmt,
+                                     stat.st_mtime_ns, stat.st_size,
+                                     ignore_hydrogen, __version__)
+    key = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+    return os.path.join(COORDINATES_CACHE_DIR, key + ".npz")
+
+
+def get_coordinates(filename, fmt, soa=False, cache=False, ignore_hydrogen=False):
     """
     Get coordinates from filename in format fmt. Supports XYZ and PDB.
     Parameters
@@ -960,24 +1564,143 @@ def get_coordinates(filename, fmt):
         Filename to read
     fmt : string
         Format of filename. Either xyz or pdb.
+    soa : bool (optional)
+        Return the coordinates as Coords of per-axis arrays instead of an
+        (N,3) matrix.
+    cache : bool (optional)
+        Keep the parsed coordinates in COORDINATES_CACHE_DIR, and load them
+        from there instead of parsing the file again.
+    ignore_hydrogen : bool (optional)
+        Leave out the hydrogen atoms while parsing.
     Returns
     -------
     atoms : list
         List of atomic types
-    V : array
-        (N,3) where N is number of atoms
+    V : array or Coords
+        (N,3) where N is number of atoms, or Coords of three (N) arrays if
+        soa is True
     """
     if fmt == "xyz" or fmt == "xyzgz" or fmt == "xyz.gz":
         get_func = get_coordinates_xyz
     elif fmt == "pdb" or fmt == "pdbgz" or fmt == "pdb.gz":
         get_func = get_coordinates_pdb
     else:
-        exit("Could not recognize file format: {:s}".format(fmt))
+        raise ParseError("Could not recognize file format: {:s}".format(fmt))
+
+    if cache:
+        cache_file = _coordinates_cache_file(filename, fmt, ignore_hydrogen)
+        if os.path.exists(cache_file):
+            with np.load(cache_file) as data:
+                atoms = data['atoms']
+                V = data['V']
+        else:
+            atoms, V = get_func(filename, ignore_hydrogen=ignore_hydrogen)
+            # Write to a temporary file first so other processes never see a
+            # partial cache file
+            os.makedirs(COORDINATES_CACHE_DIR, exist_ok=True)
+            tmp_file = "{}.{}.npz".format(cache_file[:-4], os.getpid())
+            np.savez(tmp_file, atoms=atoms, V=V)
+            os.replace(tmp_file, cache_file)
+    else:
+        atoms, V = get_func(filename, ignore_hydrogen=ignore_hydrogen)
+
+    if soa:
+        V = Coords(*np.ascontiguousarray(np.transpose(V)))
+
+    return atoms, V
 
-    return get_func(filename)
 
+# Read buffer size for coordinate files
+_READ_BUFFER_SIZE = 1 << 20
 
-def get_coordinates_pdb(filename):
+
+def _open_coordinates(filename):
+    """
+    Open a plain or gzipped coordinate file for reading text, with a large
+    read buffer. Coordinate files are ASCII, so they are decoded as latin-1,
+    which never has to validate multi-byte sequences.
+    Parameters
+    ----------
+    filename : string
+        Filename to read, gzipped if it ends with gz
+    Returns
+    -------
+    f : file object
+        Text file object
+    """
+    if filename[-2:] == "gz":
+        raw = io.BufferedReader(gzip.open(filename, 'rb'), _READ_BUFFER_SIZE)
+    else:
+        raw = open(filename, 'rb', buffering=_READ_BUFFER_SIZE)
+
+    return io.TextIOWrapper(raw, encoding='latin-1')
+
+
+def _get_coordinates_pdb_columns(lines, ignore_hydrogen=False):
+    """
+    Get atom types and coordinates from PDB ATOM lines in bulk, assuming the
+    standard fixed columns. The atom name is in column 13-16 and x, y and z
+    are in column 31-38, 39-46 and 47-54, with the decimal point in column 35,
+    43 and 51.
+    Parameters
+    ----------
+    lines : list
+        ATOM lines of a PDB file
+    ignore_hydrogen : bool (optional)
+        Leave out the hydrogen atoms
+    Returns
+    -------
+    atoms : list or None
+        List of atomic types, None if the lines are not in the fixed columns
+        layout
+    V : array
+        (N,3) where N is number of atoms
+    """
+    if not lines:
+        return None
+
+    try:
+        records = np.array(lines, dtype='S80')
+    except UnicodeEncodeError:
+        return None
+
+    chars = records.view('S1').reshape(len(lines), 80)
+    if not (chars[:, [34, 42, 50]] == b'.').all():
+        return None
+
+    # The atom type is the first letter of the atom name, or the second for
+    # hydrogens named like 1HD1
+    names = np.char.strip(np.ascontiguousarray(chars[:, 12:16]).view('S4')[:, 0])
+    first = names.astype('S1')
+    second = names.view('S1').reshape(len(lines), 4)[:, 1]
+    element = np.isin(first, [b'H', b'C', b'N', b'O', b'S', b'P'])
+    hydrogen = second == b'H'
+    if not (element | hydrogen).all():
+        return None
+
+    atoms = np.where(element, first, b'H')
+
+    # Only the coordinates of the kept atoms are parsed
+    if ignore_hydrogen:
+        heavy = atoms != b'H'
+        atoms = atoms[heavy]
+        chars = chars[heavy]
+
+    atoms = atoms.astype(str)
+
+    try:
+        V = np.ascontiguousarray(chars[:, 30:54]).view('S8').astype(float)
+    except ValueError:
+        return None
+
+    return atoms, V
+
+
+# Three consecutive decimal numbers, i.e. the x, y and z columns of a PDB line
+_COORD_RE = re.compile(r'(-?\d+\.\d+)\s+(-?\d+\.\d+)\s+(-?\d+\.\d+)')
+
+
+def get_coordinates_pdb(filename, ignore_hydrogen=False):
     """
     Get coordinates from the first chain in a pdb file
     and return a vectorset with all the coordinates.
@@ -985,6 +1708,8 @@ def get_coordinates_pdb(filename):
     ----------
     filename : string
         Filename to read
+    ignore_hydrogen : bool (optional)
+        Leave out the hydrogen atoms
     Returns
     -------
     atoms : list
@@ -996,80 +1721,88 @@ def get_coordinates_pdb(filename):
     # PDB files tend to be a bit of a mess. The x, y and z coordinates
     # are supposed to be in column 31-38, 39-46 and 47-54, but this is
     # not always the case.
-    # Because of this the three first columns containing a decimal is used.
+    # Because of this the first three consecutive decimal numbers are used.
     # Since the format doesn't require a space between columns, we use the
     # above column indices as a fallback.
 
-    x_column = None
-    V = list()
-
     # Same with atoms and atom naming.
     # The most robust way to do this is probably
     # to assume that the atomtype is given in column 3.
 
-    atoms = list()
+    with _open_coordinates(filename) as f:
+        lines = f.readlines()
 
-    if filename[-2:] =="gz":
-        openfunc = gzip.open
-        openarg = 'rt'
-    else:
-        openfunc = open
-        openarg = 'r'
+    # Only read up to the end of the first chain
+    for i, line in enumerate(lines):
+        if line.startswith("TER") or line.startswith("END"):
+            lines = lines[:i]
+            break
 
-    with openfunc(filename, openarg) as f:
-        lines = f.readlines()
-        for line in lines:
-            if line.startswith("TER") or line.startswith("END"):
-                break
-            if line.startswith("ATOM"):
-                tokens = line.split()
-                # Try to get the atomtype
-                try:
-                    atom = tokens[2][0]
-                    if atom in ("H", "C", "N", "O", "S", "P"):
-                        atoms.append(atom)
-                    else:
-                        # e.g. 1HD1
-                        atom = tokens[2][1]
-                        if atom == "H":
-                            atoms.append(atom)
-                        else:
-                            raise Exception
-                except:
-                    exit("error: Parsing atomtype for the following line: \n{0:s}".format(line))
-
-                if x_column is None:
-                    try:
-                        # look for x column
-                        for i, x in enumerate(tokens):
-                            if "." in x and "." in tokens[i + 1] and "." in tokens[i + 2]:
-                                x_column = i
-                                break
-                    except IndexError:
-                        exit("error: Parsing coordinates for the following line: \n{0:s}".format(line))
-                # Try to read the coordinates
-                try:
-                    V.append(np.asarray(tokens[x_column:x_column + 3], dtype=float))
-                except:
-                    # If that doesn't work, use hardcoded indices
-                    try:
-                        x = line[30:38]
-                        y = line[38:46]
-                        z = line[46:54]
-                        V.append(np.asarray([x, y ,z], dtype=float))
-                    except:
-                        exit("error: Parsing input for the following line: \n{0:s}".format(line))
-
-
-    V = np.asarray(V)
-    atoms = np.asarray(atoms)
+    lines = [line for line in lines if line.startswith("ATOM")]
+
+    # Well-formed files are parsed in bulk from the fixed columns
+    fixed = _get_coordinates_pdb_columns(lines, ignore_hydrogen=ignore_hydrogen)
+    if fixed is not None:
+        return fixed
+
+    V = np.empty((len(lines), 3))
+    atoms = np.empty(len(lines), dtype=object)
+    i = 0
+
+    for line in lines:
+        tokens = line.split()
+        # Try to get the atomtype
+        try:
+            atom = tokens[2][0]
+            if atom not in ("H", "C", "N", "O", "S", "P"):
+                # e.g. 1HD1
+                atom = tokens[2][1]
+                if atom != "H":
+                    raise Exception
+        except:
+            raise ParseError("Parsing atomtype for the following line: \n{0:s}".format(line))
+
+        if ignore_hydrogen and atom == "H":
+            continue
+
+        atoms[i] = atom
+
+        # Try to read the coordinates. Columns that run together are not
+        # separated by whitespace, so a match that starts after the x field
+        # has skipped the real coordinates.
+        match = _COORD_RE.search(line)
+        if match is not None and match.start(1) < 38:
+            V[i, 0] = float(match.group(1))
+            V[i, 1] = float(match.group(2))
+            V[i, 2] = float(match.group(3))
+        else:
+            # If that doesn't work, use hardcoded indices
+            try:
+                V[i, 0] = float(line[30:38])
+                V[i, 1] = float(line[38:46])
+                V[i, 2] = float(line[46:54])
+            except:
+                raise ParseError("Parsing input for the following line: \n{0:s}".format(line))
+
+        i += 1
+
+    V = V[:i]
+    atoms = atoms[:i].astype(str)
 
     assert V.shape[0] == atoms.size
 
     return atoms, V
 
 
-def get_coordinates_xyz(filename):
+# Columns of an atom line in an XYZ file
+_XYZ_DTYPE = np.dtype([
+    ('atom', 'U8'),
+    ('x', np.float64),
+    ('y', np.float64),
+    ('z', np.float64)])
+
+
+def get_coordinates_xyz(filename, ignore_hydrogen=False):
     """
     Get coordinates from filename and return a vectorset with all the
     coordinates, in XYZ format.
@@ -1077,6 +1810,8 @@ def get_coordinates_xyz(filename):
     ----------
     filename : string
         Filename to read
+    ignore_hydrogen : bool (optional)
+        Leave out the hydrogen atoms
     Returns
     -------
     atoms : list
@@ -1085,49 +1820,74 @@ def get_coordinates_xyz(filename):
         (N,3) where N is number of atoms
     """
 
-    if filename[-2:] =="gz":
-        openfunc = gzip.open
-        openarg = 'rt'
-    else:
-        openfunc = open
-        openarg = 'r'
-
-    f = openfunc(filename, openarg)
-    V = list()
-    atoms = list()
     n_atoms = 0
 
-    # Read the first line to obtain the number of atoms to read
+    with _open_coordinates(filename) as f:
+
+        # Read the first line to obtain the number of atoms to read
+        try:
+            n_atoms = int(f.readline())
+        except ValueError:
+            raise ParseError("Could not obtain the number of atoms in the .xyz file.")
+
+        # Skip the title line
+        f.readline()
+
+        # Use the number of atoms to not read beyond the end of a file
+        lines = list(itertools.islice(f, n_atoms))
+
+    if not lines:
+        return np.array([]), np.array([])
+
+    # Parse all atom lines in one go. Lines that are not plain
+    # "atom x y z ..." columns are handled line by line below, as are blank
+    # lines (skipped by loadtxt) and nan or inf coordinates, so they raise
+    # a ParseError there.
     try:
-        n_atoms = int(f.readline())
+        data = np.loadtxt(lines, dtype=_XYZ_DTYPE, usecols=(0, 1, 2, 3), ndmin=1)
+        data_atoms = np.char.upper(data['atom'])
+        if len(data) != len(lines):
+            raise ValueError("blank atom lines")
+        if not np.char.isalpha(data_atoms).all():
+            raise ValueError("atom types are not element symbols")
+        V = np.column_stack((data['x'], data['y'], data['z']))
+        if not np.isfinite(V).all():
+            raise ValueError("coordinates are not finite")
+        if ignore_hydrogen:
+            heavy = data_atoms != 'H'
+            V = V[heavy]
+            data_atoms = data_atoms[heavy]
+        return data_atoms, V
     except ValueError:
-        exit("error: Could not obtain the number of atoms in the .xyz file.")
+        pass
 
-    # Skip the title line
-    f.readline()
+    V = np.empty((len(lines), 3))
+    atoms = np.empty(len(lines), dtype=object)
+    i = 0
 
-    # Use the number of atoms to not read beyond the end of a file
-    for lines_read, line in enumerate(f):
+    for lines_read, line in enumerate(lines):
 
-        if lines_read == n_atoms:
-            break
+        atom = re.findall(r'[a-zA-Z]+', line)
+        if not atom:
+            raise ParseError("Reading the .xyz file failed in line {0}. Please check the format.".format(lines_read + 2))
+        atom = atom[0].upper()
 
-        atom = re.findall(r'[a-zA-Z]+', line)[0]
-        atom = atom.upper()
+        if ignore_hydrogen and atom == "H":
+            continue
 
         numbers = re.findall(r'[-]?\d+\.\d*(?:[Ee][-\+]\d+)?', line)
         numbers = [float(number) for number in numbers]
 
         # The numbers are not valid unless we obtain exacly three
         if len(numbers) >= 3:
-            V.append(np.array(numbers)[:3])
-            atoms.append(atom)
+            V[i] = numbers[:3]
+            atoms[i] = atom
+            i += 1
         else:
-            exit("Reading the .xyz file failed in line {0}. Please check the format.".format(lines_read + 2))
+            raise ParseError("Reading the .xyz file failed in line {0}. Please check the format.".format(lines_read + 2))
 
-    f.close()
-    atoms = np.array(atoms)
-    V = np.array(V)
+    V = V[:i]
+    atoms = atoms[:i].astype(str)
     return atoms, V
 
 
@@ -1179,6 +1939,7 @@ See https://github.com/charnley/rmsd for citation information
     # format and print
     parser.add_argument('--format', action='store', help='format of input files. valid format are xyz and pdb', metavar='FMT')
     parser.add_argument('-p', '--output', '--print', action='store_true', help='print out structure B, centered and rotated unto structure A\'s coordinates in XYZ format')
+    parser.add_argument('--cache', action='store_true', help='cache the parsed structures in {} to skip parsing them again in later runs'.format(COORDINATES_CACHE_DIR))
 
     if len(sys.argv) == 1:
         parser.print_help()
@@ -1200,8 +1961,18 @@ See https://github.com/charnley/rmsd for citation information
             args.format = filename_suffix
 
 
-    p_all_atoms, p_all = get_coordinates(args.structure_a, args.format)
-    q_all_atoms, q_all = get_coordinates(args.structure_b, args.format)
+    # Unless the full structure is printed, hydrogens are left out already
+    # while parsing
+    ignore_hydrogen = args.no_hydrogen and not args.output
+
+    try:
+        p_all_atoms, p_all = get_coordinates(args.structure_a, args.format,
+            cache=args.cache, ignore_hydrogen=ignore_hydrogen)
+        q_all_atoms, q_all = get_coordinates(args.structure_b, args.format,
+            cache=args.cache, ignore_hydrogen=ignore_hydrogen)
+    except ParseError as e:
+        print("error: {}".format(e))
+        sys.exit(1)
 
     p_size = p_all.shape[0]
     q_size = q_all.shape[0]
@@ -1210,7 +1981,7 @@ See https://github.com/charnley/rmsd for citation information
         print("error: Structures not same size")
         quit()
 
-    if np.count_nonzero(p_all_atoms != q_all_atoms) and not args.reorder:
+    if not np.array_equal(p_all_atoms, q_all_atoms) and not args.reorder:
         msg = """
 error: Atoms are not in the same order.
 Use --reorder to align the atoms (can be expensive for large structures).
@@ -1226,28 +1997,36 @@ https://github.com/charnley/rmsd for further examples.
     q_view = None
 
 
-    if args.no_hydrogen:
-        p_view = np.where(p_all_atoms != 'H')
-        q_view = np.where(q_all_atoms != 'H')
+    if args.no_hydrogen and not ignore_hydrogen:
+        p_view = p_all_atoms != 'H'
+        # Without --reorder the atoms are already checked to be identical,
+        # so the same mask selects the heavy atoms of both structures
+        if args.reorder:
+            q_view = q_all_atoms != 'H'
+        else:
+            q_view = p_view
 
     elif args.remove_idx:
-        index = range(p_size)
-        index = set(index) - set(args.remove_idx)
-        index = list(index)
-        p_view = index
-        q_view = index
+        # Indices outside the structure are ignored, as they are not atoms
+        remove_idx = np.asarray(args.remove_idx, dtype=np.intp)
+        remove_idx = remove_idx[(remove_idx >= 0) & (remove_idx < p_size)]
+        p_view = np.ones(p_size, dtype=bool)
+        p_view[remove_idx] = False
+        q_view = p_view
 
     elif args.add_idx:
-        p_view = args.add_idx
-        q_view = args.add_idx
+        p_view = np.asarray(args.add_idx, dtype=np.intp)
+        q_view = p_view
 
 
     # Set local view
     if p_view is None:
-        p_coord = copy.deepcopy(p_all)
-        q_coord = copy.deepcopy(q_all)
-        p_atoms = copy.deepcopy(p_all_atoms)
-        q_atoms = copy.deepcopy(q_all_atoms)
+        # The centered coordinates below are new arrays, and the atoms are
+        # never modified, so no copies are needed
+        p_coord = p_all
+        q_coord = q_all
+        p_atoms = p_all_atoms
+        q_atoms = q_all_atoms
 
     else:
 
@@ -1259,19 +2038,21 @@ https://github.com/charnley/rmsd for further examples.
             print("error: Cannot use reflections on atoms and print, when excluding atoms (such as --no-hydrogen)")
             quit()
 
-        p_coord = copy.deepcopy(p_all[p_view])
-        q_coord = copy.deepcopy(q_all[q_view])
-        p_atoms = copy.deepcopy(p_all_atoms[p_view])
-        q_atoms = copy.deepcopy(q_all_atoms[q_view])
+        p_coord = p_all[p_view]
+        q_coord = q_all[q_view]
+        p_atoms = p_all_atoms[p_view]
+        q_atoms = q_all_atoms[q_view]
 
 
     # Create the centroid of P and Q which is the geometric center of a
     # N-dimensional region and translate P and Q onto that center.
     # http://en.wikipedia.org/wiki/Centroid
+    # Centering into new arrays copies and translates the coordinates in a
+    # single pass, and leaves p_all and q_all untouched.
     p_cent = centroid(p_coord)
     q_cent = centroid(q_coord)
-    p_coord -= p_cent
-    q_coord -= q_cent
+    p_coord = p_coord - p_cent
+    q_coord = q_coord - q_cent
 
 
     # set rotation method
@@ -1314,26 +2095,20 @@ https://github.com/charnley/rmsd for further examples.
     result_rmsd = None
 
 
-    if args.use_reflections:
-
-        result_rmsd, q_swap, q_reflection, q_review = check_reflections(
-            p_atoms,
-            q_atoms,
-            p_coord,
-            q_coord,
-            reorder_method=reorder_method,
-            rotation_method=rotation_method)
+    if args.use_reflections or args.use_reflections_keep_stereo:
 
-    elif args.use_reflections_keep_stereo:
-
-        result_rmsd, q_swap, q_reflection, q_review = check_reflections(
-            p_atoms,
-            q_atoms,
-            p_coord,
-            q_coord,
-            reorder_method=reorder_method,
-            rotation_method=rotation_method,
-            keep_stereo=True)
+        try:
+            result_rmsd, q_swap, q_reflection, q_review = check_reflections(
+                p_atoms,
+                q_atoms,
+                p_coord,
+                q_coord,
+                reorder_method=reorder_method,
+                rotation_method=rotation_method,
+                keep_stereo=not args.use_reflections)
+        except RuntimeError as e:
+            print("error: {}".format(e))
+            quit()
 
     elif args.reorder:
 
@@ -1341,7 +2116,7 @@ https://github.com/charnley/rmsd for further examples.
         q_coord = q_coord[q_review]
         q_atoms = q_atoms[q_review]
 
-        if not all(p_atoms == q_atoms):
+        if not np.array_equal(p_atoms, q_atoms):
             print("error: Structure not aligned")
             quit()
 
@@ -1354,8 +2129,10 @@ https://github.com/charnley/rmsd for further examples.
                 print("error: Reorder length error. Full atom list needed for --print")
                 quit()
 
-            q_all = q_all[q_review]
-            q_all_atoms = q_all_atoms[q_review]
+            # np.take gathers whole rows, without the general fancy indexing
+            # machinery
+            q_all = np.take(q_all, q_review, axis=0)
+            q_all_atoms = np.take(q_all_atoms, q_review)
 
         # Get rotation matrix
         U = kabsch(q_coord, p_coord)